@@ -1,12 +1,16 @@
 #!/usr/bin/python3
-from bottle import post, get, run, request, static_file, redirect, abort, response
+from bottle import post, get, run, request, static_file, redirect, abort, response, HTTPResponse, BaseRequest
 import os
-import shutil
 from .build import ParallelBuild
 from .fakebuild import ParallelFakeBuild
 from .image import Image
-from pprint import pprint
+from .placement import HostPool
+from .scheduler import Resources
+from .source import SourceArchive, etag_matches
+from .validation import verify_specification, verify_request_size, get_file_mode, Limits, SpecificationError, \
+    REDIRECT, COMMANDS, IMAGE, RESOURCES, FILES, PATH, MODE, CONTENT, BASE64, CACHE, DEFAULT_FILE_MODE
 import json
+import base64
 
 APPLICATION = 'CodersOS-image-server'
 APPDATA_ROOT = os.environ.get('APPDATA', '/var/' + APPLICATION)
@@ -14,6 +18,13 @@ APPDATA = os.path.join(APPDATA_ROOT, APPLICATION)
 HERE = os.path.dirname(__file__) or os.getcwd()
 ZIP_PATH = "/" + APPLICATION + ".zip"
 BASE_IMAGE = "codersosimages/xubuntu-16.04.1-desktop-amd64"
+DOCKER_HOSTS = os.environ.get("DOCKER_HOSTS", "")
+DEFAULT_RESOURCES = Resources.from_dict({
+    "cpus": os.environ.get("BUILD_CPUS"),
+    "memory": os.environ.get("BUILD_MEMORY"),
+    "disk": os.environ.get("BUILD_DISK")})
+LIMITS = Limits.from_environment(os.environ)
+BaseRequest.MEMFILE_MAX = LIMITS.body_size
 
 # --------------------- enable ayax access ---------------------
 
@@ -26,46 +37,25 @@ def enable_cors():
 
 # --------------------- POST /create ---------------------
 
-REDIRECT = "redirect"
-COMMANDS = "commands"
-NAME = "name"
-COMMAND = "command"
-ARGUMENTS = "arguments"
 STATUS = "status"
-IMAGE = "image"
-
-def is_url(url):
-    return url.startswith("http://") or url.startswith("https://")
-
-def verify_specification(specification):
-    assert isinstance(specification, dict), "The image specification must be an object"
-    assert REDIRECT in specification, "\"redirect\" must be an attribute of the specification."
-    assert is_url(specification[REDIRECT]), "The value of \"redirect\" must be a url."
-    assert COMMANDS in specification, "\"commands\" must be an attribute of the specification."
-    specification_commands = specification[COMMANDS]
-    assert isinstance(specification_commands, list), "The value of \"commands\" must be a list."
-    for index, command in enumerate(specification_commands):
-        assert isinstance(command, dict), "Command {} must be an object.".format(index)
-        assert NAME in command, "Command {} must have an attribute \"name\"."
-        assert isinstance(command[NAME], str), "The value of \"name\" of command {} must be a string.".format(index)
-        assert COMMAND in command, "Command {} must have an attribute \"command\"."
-        assert isinstance(command[COMMAND], str), "The value of \"command\" of command {} must be a string.".format(index)
-        assert ARGUMENTS in command, "Command {} must have an attribute \"arguments\"."
-        assert isinstance(command[ARGUMENTS], list), "The value of \"arguments\" of command {} must be a list.".format(index)
-        assert all(map(lambda argument: isinstance(argument, str), command[ARGUMENTS])), "All arguments in comand {} must be strings.".format(index)
-    if IMAGE in specification:
-        assert isinstance(specification[IMAGE], str), "The \"image\" attribute must be a string."
 
 builds = {}
 next_build_id = 0
+hosts = HostPool.from_string(DOCKER_HOSTS)
 
 def get_specification():
-    if "specification" in request.params:
-        specification = json.loads(request.params["specification"])
-    else:
-        specification = request.json
-    pprint(specification)
-    return specification
+    verify_request_size(request.content_length, request.get_header("Transfer-Encoding"), LIMITS)
+    try:
+        if "specification" in request.params:
+            return json.loads(request.params["specification"])
+        return request.json
+    except ValueError:
+        raise SpecificationError("The specification must be JSON.")
+
+def reject_specification(error):
+    """Respond with a JSON error that says what is wrong with the specification."""
+    raise HTTPResponse(json.dumps(error.to_dict()), status=error.status,
+                       headers={"Content-Type": "application/json"})
 
 def redirect_as_specified(specification):
     redirect_url = specification[REDIRECT]
@@ -76,31 +66,68 @@ def redirect_as_specified(specification):
     redirect_url += "status=/status/{}".format(next_build_id)
     redirect(redirect_url)
 
-def get_image(specification):
-    base_image = specification.get(IMAGE, BASE_IMAGE)
-    return Image(base_image)
-
-def start_build(specification, build_class):
+def get_base_image(specification):
+    return specification.get(IMAGE, BASE_IMAGE)
+
+def get_resources(specification):
+    resources = Resources.from_dict(specification.get(RESOURCES, {}))
+    return resources.replace_unlimited(DEFAULT_RESOURCES)
+
+def get_files(specification):
+    files = []
+    for file in specification.get(FILES, []):
+        if BASE64 in file:
+            content = base64.b64decode(file[BASE64])
+        else:
+            content = file[CONTENT]
+        mode = (get_file_mode(file[MODE]) if MODE in file else DEFAULT_FILE_MODE)
+        files.append((file[PATH], content, mode))
+    return files
+
+def start_build(specification, build_class, use_cache=True):
+    """Start a build of the specification on a docker host.
+
+    If use_cache is False, the build does not use the images of other builds
+    and its images are not used by other builds.
+    """
     global next_build_id
+    base_image = get_base_image(specification)
+    commands = specification[COMMANDS]
+    resources = get_resources(specification)
+    files = get_files(specification)
+    try:
+        host = hosts.choose(base_image, commands, resources, files)
+    except ValueError as error:
+        raise SpecificationError(str(error), RESOURCES)
     next_build_id += 1
-    image = get_image(specification)
-    build = build_class(image, specification[COMMANDS])
+    cache = None
+    docker_image = base_image
+    if use_cache:
+        cache = host.get_build_cache(base_image, files, commands, specification.get(CACHE, True))
+        docker_image = cache.docker_image or base_image
+    image = Image(docker_image, host.endpoint, resources)
+    build = build_class(image, commands, host.name, files=files, cache=cache,
+                        admission=host.reserve(resources))
+    host.add_build(build)
     build.start()
     builds[next_build_id] = build
 
+def create(build_class, use_cache=True):
+    try:
+        specification = get_specification()
+        verify_specification(specification, LIMITS)
+        start_build(specification, build_class, use_cache)
+    except SpecificationError as error:
+        reject_specification(error)
+    redirect_as_specified(specification)
+
 @post("/create")
 def create_image():
-    specification = get_specification()
-    verify_specification(specification)
-    start_build(specification, ParallelBuild)
-    redirect_as_specified(specification)
+    create(ParallelBuild)
     
 @post("/test/create")
 def test_create_image():
-    specification = get_specification()
-    verify_specification(specification)
-    start_build(specification, ParallelFakeBuild)
-    redirect_as_specified(specification)
+    create(ParallelFakeBuild, use_cache=False)
 
 # --------------------- Build Status ---------------------
 
@@ -113,6 +140,10 @@ def get_status(build_id):
     build = builds[build_id]
     status = {}
     status[STATUS] = build_status = build.get_status_code()
+    status["host"] = build.get_host()
+    error = build.get_error()
+    if error is not None:
+        status["error"] = error
     if build_status == "stopped" and build.get_iso_path() is not None:
         status["download"] = "/download/{}/CodersOS.iso".format(build_id)
     status["commands"] = build.get_status()
@@ -144,12 +175,18 @@ def get_source_redirect():
     """Download the source of this application."""
     redirect(ZIP_PATH)
 
+source_archive = SourceArchive(HERE)
+
 @get(ZIP_PATH)
 def get_source():
     """Download the source of this application."""
-    # from http://stackoverflow.com/questions/458436/adding-folders-to-a-zip-file-using-python#6511788
-    path = (shutil.make_archive("/tmp/" + APPLICATION, "zip", HERE))
-    return static_file(path, root="/")
+    path, etag, last_modified = source_archive.get()
+    if etag_matches(request.headers.get("If-None-Match"), etag):
+        return HTTPResponse(status=304, headers={"ETag": etag, "Last-Modified": last_modified})
+    result = static_file(os.path.basename(path), root=os.path.dirname(path))
+    result.set_header("ETag", etag)
+    return result
 
 if __name__ == "__main__":
+    source_archive.update()
     run(host='', port=80, debug=True)
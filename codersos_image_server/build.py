@@ -1,28 +1,62 @@
 from threading import Thread
+from subprocess import CalledProcessError
+
+def describe_error(error):
+    """Return a message for the error for the build status."""
+    if isinstance(error, CalledProcessError) and (error.stderr or error.output):
+        output = error.stderr or error.output
+        return "{} {}".format(error, output.decode(errors="replace").strip())
+    return str(error) or error.__class__.__name__
 
 class Build:
 
-    def __init__(self, image, commands):
+    def __init__(self, image, commands, host=None, files=(), cache=None):
         """Create a new Build object that executes the commands on the base image.
+
+        host is the name of the docker host the image lives on.
+        files are added to the image before the commands are executed,
+        see Image.add_files().
+        cache is a BuildCache. The image must start at its docker_image.
+        The commands it has statuses for are not executed again.
         """
         self._image = image
+        self._host = host
+        self._files = list(files)
+        self._cache = cache
         self._status = []
         for command in commands:
             self._status.append({"name": command["name"], "status": "waiting"})
         self._index = iter(range(len(commands)))
         self._commands = commands
-        self._status_code = ("waiting" if commands else "stopped")
+        cached_statuses = ([] if cache is None else cache.statuses)
+        for status, cached_status in zip(self._status, cached_statuses):
+            status.update(cached_status)
+            status["cached"] = True
+            next(self._index)
+        if cached_statuses:
+            # The files are in the cached image.
+            self._files = []
+        self._status_code = ("waiting" if len(cached_statuses) < len(commands) else "stopped")
         self._iso_file = None
+        self._error = None
 
     def get_status(self):
         """Returns the status based in the previous commands.
         """
         return self._status
 
+    def get_host(self):
+        """Return the name of the docker host which runs the build."""
+        return self._host
+
     def get_status_code(self):
         """Return either "waiting" or "running" or "stopped"."""
         return self._status_code
 
+    def get_error(self):
+        """Return why the build stopped before running all commands or None."""
+        return self._error
+
     def _get_iso_file(self):
         """Returns the path to the iso image.
 
@@ -45,6 +79,8 @@ class Build:
         The iso file is deleted when the build is deleted.
         """
         assert self.get_status_code() == "stopped"
+        if self._error is not None:
+            return None
         if self._iso_file is None:
             self._iso_file = self._get_iso_file()
             if self._iso_file is None:
@@ -52,39 +88,85 @@ class Build:
         return self._iso_file.name
 
     def execute(self):
-        """Execute all commands."""
+        """Execute all commands.
+
+        If the files can not be added, the build stops with an error
+        and no command is executed.
+        """
+        try:
+            self._add_files()
+        except Exception as error:
+            self._stop("The files could not be added: " + describe_error(error))
+            return
         for i in range(len(self._status)):
             self.execute_one_command()
 
+    def _stop(self, error):
+        """Stop the build with the error before all commands are executed."""
+        self._error = error
+        self._status_code = "stopped"
+
+    def _add_files(self):
+        """Add the files to the image."""
+        if self._files:
+            self._image.add_files(self._files)
+
     def execute_one_command(self):
-        """Execute one command."""
-        stopped = True
+        """Execute one command.
+
+        If the command can not be executed, for example because docker
+        rejects the resource limits, the build stops with an error.
+        """
+        if self._error is not None:
+            return
         for index in self._index:
             self._status_code = "running"
+            status = self._status[index]
+            command = self._commands[index]
             try:
-                status = self._status[index]
-                command = self._commands[index]
                 self._execute_command(status, command)
-            finally:
-                self._status_code = ("stopped" if index == len(self._commands) - 1 else "waiting")
+                self._add_to_cache(index, status)
+            except Exception as error:
+                status["status"] = "waiting"
+                self._stop("The command could not be executed: " + describe_error(error))
+                return
+            self._status_code = ("stopped" if index == len(self._commands) - 1 else "waiting")
             break
 
     def _execute_command(self, status, command):
         """Execute the command and update the status."""
         status["status"] = "running"
-        result = self._image.execute_file(command["command"], command["arguments"]) # TODO: catch error
+        result = self._image.execute_file(command["command"], command["arguments"])
         status["status"] = "stopped"
         status["exitcode"] = result.returncode
         status["output"] = result.stdout.decode()
+        status["usage"] = result.usage
 
+    def _add_to_cache(self, index, status):
+        """Let other builds reuse the image if the command succeeded."""
+        if self._cache is not None and status.get("exitcode") == 0:
+            self._cache.add(index, self._image.docker_image, status)
 
 
 class ParallelBuild(Build):
     
-    def __init__(self, image, commands):
-        """Run the Command in a thread."""
-        super().__init__(image, commands)
-        self._thread = Thread(target=self.execute)
+    def __init__(self, image, commands, host=None, files=(), cache=None, admission=None):
+        """Run the Command in a thread.
+
+        admission is a context manager which is entered before the
+        commands run, for example PackingScheduler.reserve().
+        """
+        super().__init__(image, commands, host, files, cache)
+        self._admission = admission
+        self._thread = Thread(target=self.execute_admitted)
+
+    def execute_admitted(self):
+        """Execute all commands once the build is admitted."""
+        if self._admission is None:
+            self.execute()
+        else:
+            with self._admission:
+                self.execute()
     
     def start(self):
         """Start the parallel execution."""
@@ -1,5 +1,4 @@
-from threading import Thread
-from .build import Build
+from .build import Build, ParallelBuild
 import time
 import random
 
@@ -21,21 +20,20 @@ class FakeBuild(Build):
         """
         return None
 
+    def _add_files(self):
+        pass
+
+    def _add_to_cache(self, index, status):
+        pass
+
     def _execute_command(self, status, command):
         status["status"] = "running"
         time.sleep(self.SECONDS_PER_COMMAND)
         status["status"] = "stopped"
         status["exitcode"] = (0 if random.random() < 0.7 else random.randint(1, 20))
         status["output"] = repr(status) + "\r\n\r\n" + repr(command)
+        status["usage"] = {"memory": None, "cpu_seconds": None, "cpus": None, "disk": None}
 
-class ParallelFakeBuild(FakeBuild):
-    
-    def __init__(self, image, commands):
-        """Run the Command in a thread."""
-        super().__init__(image, commands)
-        self._thread = Thread(target=self.execute)
-    
-    def start(self):
-        """Start the parallel execution."""
-        self._thread.start()
+class ParallelFakeBuild(FakeBuild, ParallelBuild):
+    """Run the fake commands in a thread."""
 
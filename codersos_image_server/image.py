@@ -1,33 +1,121 @@
+import io
 import os
+import tarfile
+import time
 
 from shutil import rmtree
 from subprocess import run, STDOUT, PIPE, CalledProcessError
 from tempfile import mkdtemp, NamedTemporaryFile
 from contextlib import contextmanager
+from uuid import uuid4
+from .scheduler import Resources
 
 
-def docker(*args, **kw):
-    """Run a docker command."""
+def docker_endpoint(host):
+    """Return the host as an endpoint for `docker -H`.
+
+    A socket path like `/var/run/docker.sock` becomes
+    `unix:///var/run/docker.sock` because docker reads endpoints
+    without a scheme as tcp.
+    """
+    if host and host.startswith("/"):
+        return "unix://" + host
+    return host
+
+def docker(*args, host=None, **kw):
+    """Run a docker command.
+
+    If host is given, the command is sent to this docker daemon.
+    It can be anything `docker -H` accepts, for example
+    `unix:///var/run/docker.sock` or `tcp://10.0.0.2:2375`,
+    or the path of a socket, see docker_endpoint().
+    """
     kw.setdefault("check", True)
     kw.setdefault("stdout", PIPE)
     kw.setdefault("stderr", PIPE)
-    return run(("docker", ) + args, **kw)
+    host_arguments = (("-H", docker_endpoint(host)) if host else ())
+    return run(("docker", ) + host_arguments + args, **kw)
 
 def docker_id(process):
     """Return the docker id from the process output."""
     return process.stdout.decode().strip()
 
+# The command is run by this script so that the peak memory and the CPU time
+# of the container can be read from its cgroup when the command is finished.
+# They are printed after the output of the command behind a random marker
+# which is passed as $0, see split_usage().
+USAGE_SCRIPT = """"$@"
+code=$?
+cgroup=/sys/fs/cgroup
+memory=$(cat $cgroup/memory.peak $cgroup/memory/memory.max_usage_in_bytes 2>/dev/null | head -n 1)
+cpu_usec=$(sed -n "s/^usage_usec //p" $cgroup/cpu.stat 2>/dev/null)
+cpu_nsec=$(cat $cgroup/cpuacct/cpuacct.usage $cgroup/cpu,cpuacct/cpuacct.usage 2>/dev/null | head -n 1)
+printf "\\n%s %s %s %s\\n" "$0" "${memory:--}" "${cpu_usec:--}" "${cpu_nsec:--}"
+exit $code
+"""
+
+def split_usage(output, marker, seconds):
+    """Split the output of USAGE_SCRIPT into the output of the command and the usage.
+
+    seconds is how long the command ran.
+    The usage is a dict:
+    "memory" is the peak memory in bytes,
+    "cpu_seconds" is the CPU time and
+    "cpus" is the average number of CPUs used.
+    Values which could not be measured are None.
+    """
+    usage = {"memory": None, "cpu_seconds": None, "cpus": None}
+    index = output.rfind(b"\n" + marker.encode() + b" ")
+    if index < 0:
+        return output, usage
+    values = [None if value == b"-" else value
+              for value in output[index + 1:].split()[1:4]]
+    try:
+        memory, cpu_usec, cpu_nsec = values
+        if memory is not None:
+            usage["memory"] = int(memory)
+        if cpu_usec is not None:
+            usage["cpu_seconds"] = int(cpu_usec) / 10 ** 6
+        elif cpu_nsec is not None:
+            usage["cpu_seconds"] = int(cpu_nsec) / 10 ** 9
+    except ValueError:
+        pass
+    if usage["cpu_seconds"] is not None and seconds > 0:
+        usage["cpus"] = usage["cpu_seconds"] / seconds
+    return output[:index], usage
+
+
 class Image(object):
 
-    def __init__(self, base_docker_image):
+    def __init__(self, base_docker_image, docker_host=None, resources=Resources()):
         """Create a new image based on the base_docker_image.
+
+        docker_host is the daemon endpoint to run all docker commands on.
+        If it is None, the default daemon of the docker client is used.
+        resources limit the containers which execute commands.
         """
         self._image = base_docker_image
+        self._docker_host = docker_host
+        self._resources = resources
         self.create_container()
 
+    @property
+    def docker_host(self):
+        """The endpoint of the docker daemon this image lives on."""
+        return self._docker_host
+
+    @property
+    def resources(self):
+        """The resource limits of the commands."""
+        return self._resources
+
+    def _docker(self, *args, **kw):
+        """Run a docker command on the docker host of this image."""
+        return docker(*args, host=self._docker_host, **kw)
+
     def copy(self):
         """Create a copy of this image."""
-        copy = self.__class__(self._image)
+        copy = self.__class__(self._image, self._docker_host, self._resources)
         self.create_container()
         return copy
 
@@ -54,15 +142,15 @@ class Image(object):
         if not self.has_docker_image():
             raise ValueError("Image {} not found.".format(self._image))
         try:
-            container_id = docker_id(docker("create", self._image))
+            container_id = docker_id(self._docker("create", self._image))
         except CalledProcessError:
             raise ValueError("Image {} not found.".format(self._image))
         yield container_id
         self.__use_container_image(container_id)
 
     def __use_container_image(self, container_id):
-        self._image = docker_id(docker("commit", container_id))
-        docker("rm", container_id)
+        self._image = docker_id(self._docker("commit", container_id))
+        self._docker("rm", container_id)
 
     def _create_container(self):
         """This creates the container based on the docker_image.
@@ -82,7 +170,7 @@ class Image(object):
         This can only be executed after create_container() is executed.
         """
         if self.has_docker_image():
-            docker("rmi", self._image)
+            self._docker("rmi", self._image)
             self._image = None
 
     def has_docker_image(self):
@@ -98,23 +186,47 @@ class Image(object):
             execute_command(["ls", "/"])
 
         :return: The exit code and stdout.
+            The usage of the command is in the `usage` attribute,
+            see split_usage(). It also has the "disk" of the container in bytes.
         :rtype: subprocess.CompletedProcess
 
         You can only execute one command at a time!
+        The image must contain /bin/sh to measure the usage.
+        If docker can not run the container, a CalledProcessError
+        with the output of docker is raised.
         """
         assert self.has_docker_image()
         temporary_directory = mkdtemp()
         try:
             container_id_file_name = os.path.join(temporary_directory, "id")
-            result = docker("run", "--cidfile", container_id_file_name, self._image, *command,
-                            stderr=STDOUT, check=False, input=input)
+            marker = "usage-" + uuid4().hex
+            start = time.monotonic()
+            result = self._docker("run", "--cidfile", container_id_file_name,
+                                  *self._resources.docker_arguments(), self._image,
+                                  "/bin/sh", "-c", USAGE_SCRIPT, marker, *command,
+                                  stderr=STDOUT, check=False, input=input)
+            if not os.path.exists(container_id_file_name):
+                # docker did not create the container, for example
+                # because it rejected the resource limits.
+                raise CalledProcessError(result.returncode, result.args, result.stdout, result.stdout)
+            result.stdout, result.usage = split_usage(result.stdout, marker, time.monotonic() - start)
             with open(container_id_file_name) as container_id_file:
                 container_id = container_id_file.read()
+            result.usage["disk"] = self._get_disk_usage(container_id)
             self.__use_container_image(container_id)
             return result
         finally:
             rmtree(temporary_directory)
 
+    def _get_disk_usage(self, container_id):
+        """Return the bytes written to the file system of the container or None."""
+        result = self._docker("container", "inspect", "--size", "--format", "{{.SizeRw}}",
+                              container_id, check=False)
+        try:
+            return int(result.stdout.decode())
+        except ValueError:
+            return None
+
     def execute_file(self, content, arguments=()):
         """Execute a file with a certain content.
 
@@ -131,22 +243,35 @@ class Image(object):
 
         You can only execute one command at a time!
         """
-        self.add_file("/tmp/command", content)
-        self.execute_command(["chmod", "+x", "/tmp/command"]).check_returncode()
+        self.add_file("/tmp/command", content, 0o755)
         return self.execute_command(["/tmp/command"] + list(arguments))
 
-    def add_file(self, path, content):
+    def add_file(self, path, content, mode=0o644):
         """Add a file to the image."""
-        self.execute_command(["mkdir", "-p", os.path.dirname(path)])
-        if isinstance(content, bytes):
-            file = NamedTemporaryFile("wb")
-        else:
-            file = NamedTemporaryFile("w")
-        with file:
-            file.write(content)
-            file.flush()
-            with self._create_container() as container_id:
-                docker("cp", file.name, container_id + ":" + path).check_returncode()
+        self.add_files([(path, content, mode)])
+
+    def add_files(self, files):
+        """Add several files to the image at once.
+
+        files is a list of (path, content, mode) tuples.
+        The path is absolute, the content is a string or bytes
+        and the mode are the permissions like 0o644.
+        Missing directories are created.
+        All files are copied as one tar archive into one container.
+        """
+        archive = io.BytesIO()
+        now = time.time()
+        with tarfile.open(fileobj=archive, mode="w") as tar:
+            for path, content, mode in files:
+                if isinstance(content, str):
+                    content = content.encode()
+                info = tarfile.TarInfo(path.lstrip("/"))
+                info.size = len(content)
+                info.mode = mode
+                info.mtime = now
+                tar.addfile(info, io.BytesIO(content))
+        with self._create_container() as container_id:
+            self._docker("cp", "-", container_id + ":/", input=archive.getvalue()).check_returncode()
 
     def get_file(self, path, binary=True):
         """Return a file object with the copied content of the file in the container.
@@ -159,7 +284,7 @@ class Image(object):
         file = NamedTemporaryFile(mode)
         file.file.close()
         with self._create_container() as container_id:
-            result = docker("cp", container_id + ":" + path, file.name, check=False)
+            result = self._docker("cp", container_id + ":" + path, file.name, check=False)
         if result.returncode != 0:
             raise FileNotFoundError(path, result)        
         file.file = open(file.name, mode)
@@ -0,0 +1,239 @@
+import hashlib
+import json
+import shutil
+from .image import docker, docker_endpoint
+from .scheduler import PackingScheduler, Resources
+
+
+def command_prefixes(base_image, files, commands):
+    """Return a hash for each prefix of the commands.
+
+    The n-th hash identifies the image after the first n+1 commands
+    were executed on the base image with the files.
+    """
+    prefixes = []
+    hash = hashlib.sha256()
+    hash.update(base_image.encode() + b"\0")
+    for path, content, mode in files:
+        if isinstance(content, str):
+            content = content.encode()
+        hash.update("{}\0{:o}\0".format(path, mode).encode())
+        hash.update(hashlib.sha256(content).digest())
+    for command in commands:
+        hash.update(json.dumps(command, sort_keys=True).encode())
+        prefixes.append(hash.hexdigest())
+    return prefixes
+
+
+class BuildCache:
+
+    def __init__(self, host, base_image, files, commands, reuse=True):
+        """The images of a build which can be reused by other builds on the host.
+
+        When it is created, the longest prefix of the commands which was
+        already built on the host is looked up.
+        docker_image is the image after these commands or None.
+        statuses are the status of these commands.
+        If reuse is False, nothing is looked up, like `docker build --no-cache`.
+        The images of the build still replace the cached ones.
+        """
+        self._host = host
+        self._prefixes = command_prefixes(base_image, files, commands)
+        self.docker_image = None
+        self.statuses = []
+        cached_prefix_length = (host.get_cached_prefix_length(self._prefixes) if reuse else 0)
+        for length in range(cached_prefix_length, 0, -1):
+            docker_image, statuses = host.get_cached_image(self._prefixes[length - 1])
+            if host.has_image(docker_image):
+                self.docker_image = docker_image
+                self.statuses = statuses
+                break
+            host.remove_cached_image(self._prefixes[length - 1])
+
+    def add(self, index, docker_image, status):
+        """Remember the docker_image after the command with the index succeeded.
+
+        Only images after consecutive successful commands are remembered.
+        """
+        if index == len(self.statuses):
+            self.statuses = self.statuses + [dict(status)]
+            self._host.add_cached_image(self._prefixes[index], docker_image, self.statuses)
+
+
+class DockerHost:
+
+    def __init__(self, endpoint=None, data_root=None):
+        """A docker daemon builds can be placed on.
+
+        endpoint is passed to `docker -H`, None is the default daemon.
+        A socket path is turned into a `unix://` endpoint.
+        data_root is a local path on the disk the daemon stores its
+        images on, for example `/var/lib/docker`.
+        If it is None, the free disk space is unknown.
+        """
+        self._endpoint = docker_endpoint(endpoint)
+        self._data_root = data_root
+        self._builds = []
+        self._cached_images = {}
+        self._scheduler = None
+
+    @property
+    def endpoint(self):
+        """The endpoint of the docker daemon."""
+        return self._endpoint
+
+    @property
+    def name(self):
+        """The name of the host to show in the build status."""
+        return self._endpoint or "default"
+
+    def get_load(self):
+        """Return the number of builds on this host which did not stop."""
+        self._builds = [build for build in self._builds
+                        if build.get_status_code() != "stopped"]
+        return len(self._builds)
+
+    def get_free_disk(self):
+        """Return the free disk space in bytes or None if unknown."""
+        if self._data_root is None:
+            return None
+        try:
+            return shutil.disk_usage(self._data_root).free
+        except OSError:
+            return None
+
+    def get_capacity(self):
+        """Return the resources of the docker daemon.
+
+        CPUs and memory are reported by the daemon.
+        The disk is the size of the data root.
+        Resources which are unknown are not limited.
+        """
+        cpus = memory = disk = None
+        result = docker("info", "--format", "{{.NCPU}} {{.MemTotal}}",
+                        host=self._endpoint, check=False)
+        if result.returncode == 0:
+            try:
+                cpus, memory = map(int, result.stdout.decode().split())
+            except ValueError:
+                pass
+        if self._data_root is not None:
+            try:
+                disk = shutil.disk_usage(self._data_root).total
+            except OSError:
+                pass
+        return Resources(cpus, memory, disk)
+
+    @property
+    def scheduler(self):
+        """The PackingScheduler for the capacity of this host."""
+        if self._scheduler is None:
+            self._scheduler = PackingScheduler(self.get_capacity())
+        return self._scheduler
+
+    def reserve(self, resources):
+        """Return a context manager which reserves the resources on this host.
+
+        See PackingScheduler.reserve().
+        """
+        return self.scheduler.reserve(resources)
+
+    def has_image(self, docker_image):
+        """Whether the docker daemon already has the docker_image."""
+        result = docker("image", "inspect", docker_image, host=self._endpoint, check=False)
+        return result.returncode == 0
+
+    def get_cached_prefix_length(self, prefixes):
+        """Return how many of the command prefixes have a cached image on this host.
+
+        See command_prefixes().
+        """
+        length = 0
+        for prefix in prefixes:
+            if prefix not in self._cached_images:
+                break
+            length += 1
+        return length
+
+    def get_cached_image(self, prefix):
+        """Return the docker image and the command statuses of the prefix."""
+        return self._cached_images[prefix]
+
+    def add_cached_image(self, prefix, docker_image, statuses):
+        """Remember the docker image after the commands of the prefix succeeded."""
+        self._cached_images[prefix] = (docker_image, statuses)
+
+    def remove_cached_image(self, prefix):
+        """Forget the docker image of the prefix, for example because it was deleted."""
+        self._cached_images.pop(prefix, None)
+
+    def get_build_cache(self, base_image, files, commands, reuse=True):
+        """Return the BuildCache for a build on this host."""
+        return BuildCache(self, base_image, files, commands, reuse)
+
+    def add_build(self, build):
+        """Remember that the build runs on this host."""
+        self._builds.append(build)
+
+
+class HostPool:
+
+    FITS_NOW_WEIGHT = 5
+    BASE_IMAGE_WEIGHT = 2
+    CACHED_COMMAND_WEIGHT = 1
+    LOAD_WEIGHT = 3
+    FREE_GIGABYTE_WEIGHT = 0.01
+
+    @classmethod
+    def from_string(cls, string):
+        """Create a pool from a string like the DOCKER_HOSTS variable.
+
+        The hosts are separated by white space or commas.
+        Each host is an endpoint or a socket path,
+        optionally followed by `=` and the data root:
+
+            unix:///var/run/docker.sock=/var/lib/docker tcp://10.0.0.2:2375 /run/docker2.sock
+
+        An empty string creates a pool with only the default daemon.
+        """
+        hosts = []
+        for entry in string.replace(",", " ").split():
+            endpoint, _, data_root = entry.partition("=")
+            hosts.append(DockerHost(endpoint, data_root or None))
+        return cls(hosts)
+
+    def __init__(self, hosts=()):
+        """Create a pool of docker hosts to place builds on."""
+        self._hosts = list(hosts) or [DockerHost()]
+
+    @property
+    def hosts(self):
+        """The docker hosts of this pool."""
+        return list(self._hosts)
+
+    def get_score(self, host, base_image, commands, resources=Resources(), files=()):
+        """Return how well the build fits on the host. Higher is better."""
+        prefixes = command_prefixes(base_image, files, commands)
+        score = self.CACHED_COMMAND_WEIGHT * host.get_cached_prefix_length(prefixes)
+        if host.has_image(base_image):
+            score += self.BASE_IMAGE_WEIGHT
+        if host.scheduler.fits_now(resources):
+            score += self.FITS_NOW_WEIGHT
+        score -= self.LOAD_WEIGHT * host.get_load()
+        free_disk = host.get_free_disk()
+        if free_disk is not None:
+            score += self.FREE_GIGABYTE_WEIGHT * free_disk / 2 ** 30
+        return score
+
+    def choose(self, base_image, commands, resources=Resources(), files=()):
+        """Return the host to run the build of the commands on.
+
+        Only hosts with the capacity for the resources are chosen.
+        If there is no such host, a ValueError is raised.
+        """
+        hosts = [host for host in self._hosts if host.scheduler.fits(resources)]
+        if not hosts:
+            raise ValueError("No docker host has the capacity for {}.".format(resources))
+        if len(hosts) == 1:
+            return hosts[0]
+        return max(hosts, key=lambda host: self.get_score(host, base_image, commands, resources, files))
@@ -0,0 +1,148 @@
+import math
+import re
+from collections import namedtuple
+from contextlib import contextmanager
+from threading import Condition
+
+SIZE = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*([kmgt]?)(i?)(b?)\s*$", re.IGNORECASE)
+SIZE_FACTORS = {"": 0, "k": 1, "m": 2, "g": 3, "t": 4}
+# docker run rejects smaller limits.
+MINIMUM_CPUS = 0.01
+MINIMUM_MEMORY = 6 * 2 ** 20
+
+def parse_size(size):
+    """Return the number of bytes of a size.
+
+    Sizes are numbers or strings like the ones docker uses.
+    A unit without "B" is binary as in `docker run --memory 4g`.
+    "KiB" is binary and "kB" is decimal as in the output of `docker stats`.
+    """
+    if isinstance(size, (int, float)) and not isinstance(size, bool):
+        if not math.isfinite(size):
+            raise ValueError("{!r} is not a size.".format(size))
+        return int(size)
+    match = SIZE.match(size) if isinstance(size, str) else None
+    if match is None:
+        raise ValueError("{!r} is not a size.".format(size))
+    number, unit, binary, byte = match.groups()
+    base = (1000 if byte and not binary else 1024)
+    return int(float(number) * base ** SIZE_FACTORS[unit.lower()])
+
+def positive(name, value, minimum=None):
+    """Return the value if it is finite and positive, otherwise raise a ValueError.
+
+    If a minimum is given, the value must also be at least the minimum.
+    """
+    if not (math.isfinite(value) and value > 0):
+        raise ValueError("The {} must be a positive number, not {!r}.".format(name, value))
+    if minimum is not None and value < minimum:
+        raise ValueError("The {} must be at least {}, not {!r}.".format(name, minimum, value))
+    return value
+
+
+class Resources(namedtuple("Resources", ["cpus", "memory", "disk"])):
+    """CPUs, memory and disk bytes of a build or a host.
+
+    None means that the resource is not limited.
+    """
+
+    __slots__ = ()
+
+    def __new__(cls, cpus=None, memory=None, disk=None):
+        return super().__new__(cls, cpus, memory, disk)
+
+    @classmethod
+    def from_dict(cls, dictionary):
+        """Create the resources from a dict like the "resources" of a specification.
+
+        Memory and disk are sizes as accepted by parse_size().
+        A ValueError is raised if a value is not finite and positive
+        or below MINIMUM_CPUS or MINIMUM_MEMORY.
+        """
+        cpus = dictionary.get("cpus")
+        memory = dictionary.get("memory")
+        disk = dictionary.get("disk")
+        return cls(None if cpus is None else positive("cpus", float(cpus), MINIMUM_CPUS),
+                   None if memory is None else positive("memory", parse_size(memory), MINIMUM_MEMORY),
+                   None if disk is None else positive("disk", parse_size(disk)))
+
+    def replace_unlimited(self, default):
+        """Return these resources with the default for unlimited resources."""
+        return self.__class__(*(default_value if value is None else value
+                                for value, default_value in zip(self, default)))
+
+    def docker_arguments(self):
+        """Return the arguments for `docker run` to limit a container."""
+        arguments = []
+        if self.cpus is not None:
+            arguments.extend(["--cpus", str(self.cpus)])
+        if self.memory is not None:
+            arguments.extend(["--memory", str(self.memory)])
+        if self.disk is not None:
+            arguments.extend(["--storage-opt", "size={}".format(self.disk)])
+        return arguments
+
+    def fits_into(self, capacity):
+        """Whether these resources are within the capacity."""
+        return all(limit is None or (value or 0) <= limit
+                   for value, limit in zip(self, capacity))
+
+    def __add__(self, other):
+        return self.__class__(*((value or 0) + (other_value or 0)
+                                for value, other_value in zip(self, other)))
+
+    def __sub__(self, other):
+        return self.__class__(*((value or 0) - (other_value or 0)
+                                for value, other_value in zip(self, other)))
+
+
+class PackingScheduler:
+
+    def __init__(self, capacity):
+        """Admit builds while the sum of their reservations fits the capacity."""
+        self._capacity = capacity
+        self._reserved = Resources(0, 0, 0)
+        self._condition = Condition()
+
+    @property
+    def capacity(self):
+        """The resources of the host."""
+        return self._capacity
+
+    def get_reserved(self):
+        """Return the sum of the reserved resources."""
+        return self._reserved
+
+    def fits(self, resources):
+        """Whether the resources can ever be reserved."""
+        return resources.fits_into(self._capacity)
+
+    def fits_now(self, resources):
+        """Whether the resources can be reserved without waiting."""
+        return (self._reserved + resources).fits_into(self._capacity)
+
+    @contextmanager
+    def _reserve(self, resources):
+        with self._condition:
+            self._condition.wait_for(lambda: self.fits_now(resources))
+            self._reserved += resources
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._reserved -= resources
+                self._condition.notify_all()
+
+    def reserve(self, resources):
+        """Return a context manager which holds the resources.
+
+        Entering it waits until the resources fit next to the other reservations.
+        Use it like this:
+
+            with scheduler.reserve(resources):
+                # run the build
+            # the resources are free for other builds
+        """
+        if not self.fits(resources):
+            raise ValueError("{} do not fit into {}.".format(resources, self._capacity))
+        return self._reserve(resources)
@@ -0,0 +1,114 @@
+import hashlib
+import os
+import zipfile
+from tempfile import mkdtemp, NamedTemporaryFile
+from threading import Lock
+from email.utils import formatdate
+
+IGNORED_DIRECTORIES = ("__pycache__", ".pytest_cache")
+IGNORED_EXTENSIONS = (".pyc", ".pyo")
+
+def etag_matches(if_none_match, etag):
+    """Whether the If-None-Match header matches the etag."""
+    if if_none_match is None:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags or "W/" + etag in tags
+
+
+class SourceArchive:
+
+    def __init__(self, directory, archive_directory=None):
+        """A zip file with the source code in the directory.
+
+        The archive is built when it is first used and rebuilt when the
+        content of the files in the directory changes.
+        archive_directory is where the zip files are stored.
+        By default, this is a new temporary directory.
+        """
+        self._directory = directory
+        self._archive_directory = archive_directory
+        self._lock = Lock()
+        self._fingerprint = None
+        self._hash = None
+        self._path = None
+        self._last_modified = None
+
+    def get_files(self):
+        """Return the sorted relative paths of the files to archive."""
+        files = []
+        for root, directories, file_names in os.walk(self._directory):
+            directories[:] = [directory for directory in directories
+                              if directory not in IGNORED_DIRECTORIES]
+            for file_name in file_names:
+                if not file_name.endswith(IGNORED_EXTENSIONS):
+                    path = os.path.join(root, file_name)
+                    files.append(os.path.relpath(path, self._directory))
+        files.sort()
+        return files
+
+    def _get_fingerprint(self, files):
+        """Return something that changes when the files are changed."""
+        fingerprint = []
+        for file in files:
+            stat = os.stat(os.path.join(self._directory, file))
+            fingerprint.append((file, stat.st_size, stat.st_mtime_ns))
+        return fingerprint
+
+    def _get_hash(self, files):
+        """Return the hash of the names and contents of the files."""
+        hash = hashlib.sha256()
+        for file in files:
+            hash.update(file.encode() + b"\0")
+            with open(os.path.join(self._directory, file), "rb") as opened_file:
+                hash.update(hashlib.sha256(opened_file.read()).digest())
+        return hash.hexdigest()
+
+    def _build(self, files, hash, last_modified):
+        """Build the zip file and return its path.
+
+        The zip file is written to a temporary file first and then renamed
+        so that it is never served half written.
+        """
+        if self._archive_directory is None:
+            self._archive_directory = mkdtemp(prefix="source-")
+        path = os.path.join(self._archive_directory, hash + ".zip")
+        with NamedTemporaryFile(dir=self._archive_directory, suffix=".zip", delete=False) as file:
+            with zipfile.ZipFile(file, "w", zipfile.ZIP_DEFLATED,
+                                 strict_timestamps=False) as archive:
+                for name in files:
+                    archive.write(os.path.join(self._directory, name), name)
+        os.utime(file.name, (last_modified, last_modified))
+        os.replace(file.name, path)
+        return path
+
+    def update(self):
+        """Rebuild the archive if the source code changed."""
+        with self._lock:
+            files = self.get_files()
+            fingerprint = self._get_fingerprint(files)
+            is_built = self._path is not None and os.path.isfile(self._path)
+            if fingerprint == self._fingerprint and is_built:
+                return
+            hash = self._get_hash(files)
+            if hash != self._hash or not is_built:
+                last_modified = max((mtime for _, _, mtime in fingerprint), default=0) // 10 ** 9
+                old_path = self._path
+                self._path = self._build(files, hash, last_modified)
+                if is_built and old_path != self._path:
+                    os.remove(old_path)
+                self._hash = hash
+                self._last_modified = last_modified
+            self._fingerprint = fingerprint
+
+    def get(self):
+        """Return the path, the ETag and the Last-Modified header of the zip file.
+
+        The archive is updated first.
+        The ETag is the hash of the source code.
+        Last-Modified is the time the source code was last changed.
+        """
+        self.update()
+        with self._lock:
+            return (self._path, '"{}"'.format(self._hash),
+                    formatdate(self._last_modified, usegmt=True))
@@ -0,0 +1,45 @@
+"""Measure how long it takes to verify large specifications.
+
+Run it like this:
+
+    python3 -m codersos_image_server.test.benchmark_validation
+"""
+from codersos_image_server.validation import verify_specification, Limits, SpecificationError, \
+    ARGUMENT_OVERHEAD
+from base64 import b64encode
+import timeit
+
+LIMITS = Limits()
+REPETITIONS = 10
+
+def largest_specification():
+    """Return a specification which uses all the limits."""
+    arguments = ["a", "b", "c"]
+    argument_bytes = sum(len(argument) + ARGUMENT_OVERHEAD for argument in arguments)
+    script_bytes_per_command = LIMITS.script_bytes // LIMITS.commands - argument_bytes
+    commands = [{"name": str(index),
+                 "command": "#!/bin/bash\n" + "x" * (script_bytes_per_command - 12),
+                 "arguments": arguments}
+                for index in range(LIMITS.commands)]
+    files = [{"path": "/home/ubuntu/.config/" + str(index), "mode": "0644",
+              "base64": b64encode(b"x" * 300).decode()}
+             for index in range(LIMITS.files)]
+    return {"redirect": "http://localhost/", "commands": commands, "files": files}
+
+def too_many_commands():
+    """Return a specification which exceeds the limit of commands by far."""
+    command = {"name": "", "command": "", "arguments": []}
+    return {"redirect": "http://localhost/", "commands": [command] * LIMITS.commands * 100}
+
+def benchmark(name, specification, valid=True):
+    def verify():
+        try:
+            verify_specification(specification, LIMITS)
+        except SpecificationError:
+            assert not valid
+    seconds = timeit.timeit(verify, number=REPETITIONS) / REPETITIONS
+    print("{:<20} {:8.2f} ms".format(name, seconds * 1000))
+
+if __name__ == "__main__":
+    benchmark("largest", largest_specification())
+    benchmark("too many commands", too_many_commands(), valid=False)
@@ -1,6 +1,8 @@
 from unittest.mock import Mock
 from pytest import fixture, raises
-from codersos_image_server.build import Build
+from codersos_image_server.build import Build, ParallelBuild
+from contextlib import contextmanager
+from subprocess import CalledProcessError
 
 @fixture
 def image():
@@ -62,10 +64,20 @@ class TestStatus:
         build.execute_one_command()
         assert build.get_status()[0]["output"] == image.execute_file.return_value.stdout.decode.return_value
 
+    def test_usage(self, build, image):
+        build.execute_one_command()
+        assert build.get_status()[0]["usage"] == image.execute_file.return_value.usage
+
     def test_build_without_commands_is_stopped(self):
         build = Build(Mock(), [])
         assert build.get_status_code() == "stopped"
 
+    def test_host(self, image, commands):
+        assert Build(image, commands, "tcp://1.2.3.4:2375").get_host() == "tcp://1.2.3.4:2375"
+
+    def test_default_host(self, build):
+        assert build.get_host() is None
+
 class TestExecution:
 
     def test_execute_calls_all_commands(self, build, commands):
@@ -89,6 +101,115 @@ class TestExecution:
             command = commands[i]
             image.execute_file.assert_called_with(command["command"], command["arguments"])
 
+class TestFiles:
+
+    FILES = [("/etc/x", "x", 0o644), ("/home/ubuntu/.bashrc", b"ls", 0o600)]
+
+    def test_files_are_added_before_the_commands(self, image, commands):
+        events = []
+        image.add_files.side_effect = lambda files: events.append(files)
+        image.execute_file.side_effect = lambda *args: events.append("executed") or Mock()
+        Build(image, commands, files=self.FILES).execute()
+        assert events == [self.FILES] + ["executed"] * len(commands)
+
+    def test_no_files_are_added(self, build, image):
+        build.execute()
+        image.add_files.assert_not_called()
+
+    def test_build_stops_if_files_can_not_be_added(self, image, commands):
+        image.add_files.side_effect = CalledProcessError(1, ["docker", "cp"], stderr=b"is a directory")
+        build = Build(image, commands, files=self.FILES)
+        build.execute()
+        assert build.get_status_code() == "stopped"
+        assert "is a directory" in build.get_error()
+        image.execute_file.assert_not_called()
+        for state in build.get_status():
+            assert state["status"] == "waiting"
+
+    def test_failed_build_has_no_iso(self, image, commands):
+        image.add_files.side_effect = OSError("disk full")
+        build = Build(image, commands, files=self.FILES)
+        build.execute()
+        assert build.get_iso_path() is None
+        image.execute_command.assert_not_called()
+
+    def test_no_error(self, build):
+        build.execute()
+        assert build.get_error() is None
+
+    def test_build_stops_if_docker_rejects_the_command(self, image, commands):
+        image.execute_file.side_effect = CalledProcessError(
+            125, ["docker", "run"], b"--storage-opt is supported only for overlay over xfs")
+        build = Build(image, commands)
+        build.execute()
+        assert build.get_status_code() == "stopped"
+        assert "--storage-opt" in build.get_error()
+        assert image.execute_file.call_count == 1
+        for state in build.get_status():
+            assert state["status"] == "waiting"
+
+    def test_commands_before_the_error_are_kept(self, image, commands):
+        image.execute_file.side_effect = [Mock(), OSError("no space left")]
+        build = Build(image, commands)
+        build.execute()
+        assert build.get_status()[0]["status"] == "stopped"
+        assert build.get_status()[1]["status"] == "waiting"
+        assert build.get_error() == "The command could not be executed: no space left"
+
+class TestCache:
+
+    @fixture
+    def cache(self):
+        cache = Mock()
+        cache.statuses = []
+        return cache
+
+    def test_image_is_cached_after_success(self, image, commands, cache):
+        image.execute_file.return_value.returncode = 0
+        build = Build(image, commands, cache=cache)
+        build.execute_one_command()
+        cache.add.assert_called_once_with(0, image.docker_image, build.get_status()[0])
+
+    def test_image_is_not_cached_after_failure(self, image, commands, cache):
+        image.execute_file.return_value.returncode = 1
+        Build(image, commands, cache=cache).execute()
+        cache.add.assert_not_called()
+
+    def test_cached_commands_are_not_executed(self, image, commands, cache):
+        cache.statuses = [{"name": commands[0]["name"], "status": "stopped", "exitcode": 0}]
+        build = Build(image, commands, files=[("/etc/x", "x", 0o644)], cache=cache)
+        assert build.get_status()[0] == dict(cache.statuses[0], cached=True)
+        build.execute()
+        image.add_files.assert_not_called()
+        assert image.execute_file.call_count == len(commands) - 1
+        assert build.get_status_code() == "stopped"
+
+    def test_build_of_cached_commands_is_stopped(self, image, commands, cache):
+        cache.statuses = [{"name": command["name"], "exitcode": 0} for command in commands]
+        assert Build(image, commands, cache=cache).get_status_code() == "stopped"
+
+
+class TestAdmission:
+
+    def test_commands_run_after_admission(self, image, commands):
+        events = []
+        @contextmanager
+        def admission():
+            events.append("admitted")
+            yield
+            events.append("released")
+        image.execute_file.side_effect = lambda *args: events.append("executed") or Mock()
+        build = ParallelBuild(image, commands, admission=admission())
+        build.start()
+        build._thread.join()
+        assert events == ["admitted"] + ["executed"] * len(commands) + ["released"]
+
+    def test_without_admission(self, image, commands):
+        build = ParallelBuild(image, commands)
+        build.start()
+        build._thread.join()
+        assert build.get_status_code() == "stopped"
+
 class TestISOPath:
 
     @fixture
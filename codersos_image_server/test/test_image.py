@@ -1,4 +1,6 @@
-from codersos_image_server.image import Image
+from codersos_image_server import image as image_module
+from codersos_image_server.image import Image, USAGE_SCRIPT, split_usage, docker, docker_endpoint
+from codersos_image_server.scheduler import Resources
 from pytest import fixture, raises
 import subprocess
 from unittest.mock import Mock
@@ -17,6 +19,41 @@ def image():
     yield image
     image.delete()
 
+class FakeDocker:
+    """Record the calls of the docker command instead of running docker."""
+
+    def __init__(self):
+        self.calls = []
+        self.rejects_containers = False
+
+    def run(self, args, **kw):
+        self.calls.append(list(args))
+        if "run" in args and self.rejects_containers:
+            return subprocess.CompletedProcess(args, 125, b"docker: Error response from daemon: "
+                                               b"Minimum memory limit allowed is 6MB.")
+        if "run" in args:
+            with open(args[args.index("--cidfile") + 1], "w") as cidfile:
+                cidfile.write("container")
+        return subprocess.CompletedProcess(args, 0, b"sha256:0123456789abcdef\n")
+
+    @property
+    def commands(self):
+        """The docker commands, for example "run", without global options."""
+        return {call[3] if call[1] == "-H" else call[1] for call in self.calls}
+
+
+@fixture
+def fake_docker(monkeypatch):
+    fake_docker = FakeDocker()
+    monkeypatch.setattr(image_module, "run", fake_docker.run)
+    return fake_docker
+
+def use_all_docker_commands(image):
+    image.execute_file("#!/bin/sh\ntrue")
+    image.get_file("/tmp/command").close()
+    image.delete()
+
+
 class TestCreateImage:
 
     def test_can_create_image(self):
@@ -146,6 +183,16 @@ def test_add_file(image):
     hello = image.execute_command(["cat", "/asd/asd"])
     assert hello.stdout == b"hello"
 
+def test_add_files(image):
+    image.add_files([("/asd/a", "a", 0o644), ("/asd/b/c", b"\x00c", 0o755)])
+    result = image.execute_command(["bash", "-c", "cat /asd/a /asd/b/c ; stat -c %a /asd/a /asd/b/c"])
+    assert result.stdout == b"a\x00c644\n755\n"
+
+def test_add_files_uses_one_container(image):
+    images_before = images()
+    image.add_files([("/asd/" + str(i), str(i), 0o644) for i in range(100)])
+    assert len(images() - images_before) == 1
+
 
 class TestGetFile:
 
@@ -164,3 +211,97 @@ class TestGetFile:
         with raises(FileNotFoundError):
             image.get_file("/adsasdsadsads")
 
+
+
+class TestSplitUsage:
+
+    def test_output_without_usage(self):
+        assert split_usage(b"output", "marker", 1) == \
+            (b"output", {"memory": None, "cpu_seconds": None, "cpus": None})
+
+    def test_cgroup_v2(self):
+        output, usage = split_usage(b"output\nmarker 1000 2000000 -\n", "marker", 4)
+        assert output == b"output"
+        assert usage == {"memory": 1000, "cpu_seconds": 2, "cpus": 0.5}
+
+    def test_cgroup_v1(self):
+        output, usage = split_usage(b"1\n\nmarker 1000 - 3000000000\n", "marker", 2)
+        assert output == b"1\n"
+        assert usage == {"memory": 1000, "cpu_seconds": 3, "cpus": 1.5}
+
+    def test_nothing_measured(self):
+        output, usage = split_usage(b"\nmarker - - -\n", "marker", 2)
+        assert output == b""
+        assert usage == {"memory": None, "cpu_seconds": None, "cpus": None}
+
+    def test_only_the_last_marker_counts(self):
+        output, usage = split_usage(b"\nmarker 1 - -\n\nmarker 2 - -\n", "marker", 2)
+        assert output == b"\nmarker 1 - -\n"
+        assert usage["memory"] == 2
+
+    def test_script_output(self):
+        result = subprocess.run(["/bin/sh", "-c", USAGE_SCRIPT, "marker", "sh", "-c", "echo -n x; exit 3"],
+                                stdout=subprocess.PIPE)
+        assert result.returncode == 3
+        assert split_usage(result.stdout, "marker", 1)[0] == b"x"
+
+
+def test_usage_of_command(image):
+    result = image.execute_command(["bash", "-c", "head -c 100000000 /dev/zero | tail"])
+    assert result.usage["memory"] > 0
+    assert result.usage["cpu_seconds"] > 0
+    assert result.usage["disk"] >= 0
+
+
+def test_resources_limit_commands():
+    image = Image("ubuntu", resources=Resources(memory=2 ** 30))
+    result = image.execute_command(["bash", "-c", "cat /sys/fs/cgroup/memory.max "
+                                    "/sys/fs/cgroup/memory/memory.limit_in_bytes 2>/dev/null"])
+    assert str(2 ** 30).encode() in result.stdout.split()
+    image.delete()
+
+
+def test_rejected_container_raises_error_with_docker_output(fake_docker):
+    fake_docker.rejects_containers = True
+    image = Image("ubuntu", resources=Resources(memory=2 ** 20))
+    with raises(subprocess.CalledProcessError) as error:
+        image.execute_command(["true"])
+    assert error.value.returncode == 125
+    assert b"Minimum memory limit" in error.value.output
+    image.delete()
+
+
+class TestDockerHost:
+
+    def test_all_commands_go_to_the_host(self, fake_docker):
+        use_all_docker_commands(Image("ubuntu", "unix:///tmp/docker1.sock"))
+        assert fake_docker.commands >= {"create", "commit", "rm", "run", "cp", "container", "rmi"}
+        for call in fake_docker.calls:
+            assert call[:3] == ["docker", "-H", "unix:///tmp/docker1.sock"]
+
+    def test_inspect_goes_to_the_host(self, fake_docker):
+        image = Image("ubuntu", "tcp://10.0.0.2:2375")
+        image.execute_command(["true"])
+        image.delete()
+        inspect = [call for call in fake_docker.calls if "inspect" in call]
+        assert inspect and inspect[0][:3] == ["docker", "-H", "tcp://10.0.0.2:2375"]
+
+    def test_default_daemon_without_host(self, fake_docker):
+        use_all_docker_commands(Image("ubuntu"))
+        for call in fake_docker.calls:
+            assert "-H" not in call
+
+
+class TestDockerEndpoint:
+
+    def test_socket_path_is_unix_endpoint(self):
+        assert docker_endpoint("/var/run/docker.sock") == "unix:///var/run/docker.sock"
+
+    def test_endpoint_is_unchanged(self):
+        assert docker_endpoint("unix:///var/run/docker.sock") == "unix:///var/run/docker.sock"
+        assert docker_endpoint("tcp://10.0.0.2:2375") == "tcp://10.0.0.2:2375"
+        assert docker_endpoint(None) is None
+
+    def test_docker_uses_unix_socket(self, fake_docker):
+        docker("info", host="/run/docker.sock")
+        assert fake_docker.calls == [["docker", "-H", "unix:///run/docker.sock", "info"]]
@@ -0,0 +1,221 @@
+from codersos_image_server import placement
+from codersos_image_server.placement import DockerHost, HostPool, command_prefixes
+from codersos_image_server.scheduler import Resources
+from pytest import raises
+from pytest import fixture
+from unittest.mock import Mock
+from collections import namedtuple
+
+Usage = namedtuple("Usage", ["total", "used", "free"])
+
+COMMANDS = [{"name": "1", "command": "do1", "arguments": []},
+            {"name": "2", "command": "do2", "arguments": ["2"]}]
+FILES = [("/etc/x", "x", 0o644)]
+
+@fixture
+def daemons(monkeypatch):
+    """Fake docker daemons which map the socket to the images they have."""
+    daemons = {"unix:///tmp/docker1.sock": set(),
+               "unix:///tmp/docker2.sock": set(),
+               "unix:///tmp/docker3.sock": set()}
+    def docker(*args, host=None, **kw):
+        if args[0] == "info":
+            return Mock(returncode=0, stdout=b"4 8589934592\n")
+        assert args[:2] == ("image", "inspect")
+        return Mock(returncode=(0 if args[2] in daemons[host] else 1))
+    monkeypatch.setattr(placement, "docker", docker)
+    return daemons
+
+@fixture
+def pool(daemons):
+    return HostPool(DockerHost(endpoint) for endpoint in sorted(daemons))
+
+def running_build():
+    build = Mock()
+    build.get_status_code.return_value = "running"
+    return build
+
+
+class TestCommandPrefixes:
+
+    def test_one_prefix_per_command(self):
+        assert len(command_prefixes("ubuntu", FILES, COMMANDS)) == len(COMMANDS)
+
+    def test_prefixes_of_same_commands_are_equal(self):
+        assert command_prefixes("ubuntu", FILES, COMMANDS)[:1] == \
+            command_prefixes("ubuntu", FILES, COMMANDS[:1])
+
+    def test_different_commands_differ(self):
+        assert command_prefixes("ubuntu", FILES, COMMANDS[1:])[0] != \
+            command_prefixes("ubuntu", FILES, COMMANDS)[0]
+
+    def test_base_image_and_files_differ(self):
+        prefix = command_prefixes("ubuntu", FILES, COMMANDS)[0]
+        assert command_prefixes("debian", FILES, COMMANDS)[0] != prefix
+        assert command_prefixes("ubuntu", [], COMMANDS)[0] != prefix
+        assert command_prefixes("ubuntu", [("/etc/x", b"y", 0o644)], COMMANDS)[0] != prefix
+        assert command_prefixes("ubuntu", [("/etc/x", b"x", 0o755)], COMMANDS)[0] != prefix
+
+
+class TestDockerHost:
+
+    def test_name_of_default_host(self):
+        assert DockerHost().name == "default"
+
+    def test_name_is_endpoint(self):
+        assert DockerHost("tcp://1.2.3.4:2375").name == "tcp://1.2.3.4:2375"
+
+    def test_socket_path_is_unix_endpoint(self):
+        assert DockerHost("/var/run/docker.sock").endpoint == "unix:///var/run/docker.sock"
+
+    def test_stopped_builds_are_no_load(self):
+        host = DockerHost()
+        host.add_build(running_build())
+        stopped = running_build()
+        host.add_build(stopped)
+        assert host.get_load() == 2
+        stopped.get_status_code.return_value = "stopped"
+        assert host.get_load() == 1
+
+    def test_free_disk_is_unknown_without_data_root(self):
+        assert DockerHost().get_free_disk() is None
+
+    def test_free_disk_of_data_root(self, tmpdir):
+        assert DockerHost(data_root=str(tmpdir)).get_free_disk() > 0
+
+    def test_cached_prefix(self):
+        host = DockerHost()
+        host.get_build_cache("ubuntu", FILES, COMMANDS).add(0, "image1", {"exitcode": 0})
+        assert host.get_cached_prefix_length(command_prefixes("ubuntu", FILES, COMMANDS)) == 1
+        assert host.get_cached_prefix_length(command_prefixes("debian", FILES, COMMANDS)) == 0
+        assert host.get_cached_prefix_length(command_prefixes("ubuntu", FILES, COMMANDS[1:])) == 0
+
+    def test_nothing_is_cached_before_a_command_ran(self):
+        host = DockerHost()
+        host.add_build(running_build())
+        cache = host.get_build_cache("ubuntu", FILES, COMMANDS)
+        assert cache.docker_image is None
+        assert cache.statuses == []
+        assert host.get_cached_prefix_length(command_prefixes("ubuntu", FILES, COMMANDS)) == 0
+
+
+class TestBuildCache:
+
+    @fixture
+    def host(self, daemons):
+        return DockerHost("unix:///tmp/docker1.sock")
+
+    def test_reuse_image_of_longest_prefix(self, host, daemons):
+        daemons[host.endpoint].update(["image1", "image2"])
+        cache = host.get_build_cache("ubuntu", FILES, COMMANDS)
+        cache.add(0, "image1", {"name": "1", "exitcode": 0})
+        cache.add(1, "image2", {"name": "2", "exitcode": 0})
+        cache = host.get_build_cache("ubuntu", FILES, COMMANDS + [{"name": "3", "command": "do3", "arguments": []}])
+        assert cache.docker_image == "image2"
+        assert cache.statuses == [{"name": "1", "exitcode": 0}, {"name": "2", "exitcode": 0}]
+
+    def test_only_consecutive_prefixes_are_cached(self, host, daemons):
+        daemons[host.endpoint].add("image2")
+        host.get_build_cache("ubuntu", FILES, COMMANDS).add(1, "image2", {"exitcode": 0})
+        assert host.get_build_cache("ubuntu", FILES, COMMANDS).docker_image is None
+
+    def test_deleted_images_are_not_reused(self, host, daemons):
+        daemons[host.endpoint].add("image1")
+        cache = host.get_build_cache("ubuntu", FILES, COMMANDS)
+        cache.add(0, "image1", {"exitcode": 0})
+        cache.add(1, "image2", {"exitcode": 0})
+        cache = host.get_build_cache("ubuntu", FILES, COMMANDS)
+        assert cache.docker_image == "image1"
+        assert len(cache.statuses) == 1
+        assert host.get_cached_prefix_length(command_prefixes("ubuntu", FILES, COMMANDS)) == 1
+
+    def test_no_reuse(self, host, daemons):
+        daemons[host.endpoint].update(["image1", "image2"])
+        host.get_build_cache("ubuntu", FILES, COMMANDS).add(0, "image1", {"exitcode": 0})
+        cache = host.get_build_cache("ubuntu", FILES, COMMANDS, reuse=False)
+        assert cache.docker_image is None
+        assert cache.statuses == []
+        cache.add(0, "image2", {"exitcode": 0})
+        assert host.get_build_cache("ubuntu", FILES, COMMANDS).docker_image == "image2"
+
+    def test_statuses_are_copied(self, host):
+        status = {"exitcode": 0}
+        host.get_build_cache("ubuntu", FILES, COMMANDS).add(0, "image1", status)
+        status["output"] = "changed"
+        assert host.get_cached_image(command_prefixes("ubuntu", FILES, COMMANDS)[0])[1] == [{"exitcode": 0}]
+
+    def test_capacity(self, daemons, tmpdir):
+        capacity = DockerHost("unix:///tmp/docker1.sock", str(tmpdir)).get_capacity()
+        assert capacity.cpus == 4
+        assert capacity.memory == 8 * 2 ** 30
+        assert capacity.disk > 0
+
+    def test_unknown_capacity_is_unlimited(self, monkeypatch):
+        monkeypatch.setattr(placement, "docker", lambda *args, **kw: Mock(returncode=1))
+        assert DockerHost().get_capacity() == Resources()
+
+    def test_reserve_on_host(self, daemons):
+        host = DockerHost("unix:///tmp/docker1.sock")
+        with host.reserve(Resources(cpus=3)):
+            assert not host.scheduler.fits_now(Resources(cpus=2))
+
+    def test_has_image(self, daemons):
+        daemons["unix:///tmp/docker2.sock"].add("ubuntu")
+        assert DockerHost("unix:///tmp/docker2.sock").has_image("ubuntu")
+        assert not DockerHost("unix:///tmp/docker1.sock").has_image("ubuntu")
+
+
+class TestHostPool:
+
+    def test_default_daemon_without_hosts(self):
+        pool = HostPool.from_string("")
+        assert [host.endpoint for host in pool.hosts] == [None]
+
+    def test_from_string(self, tmpdir):
+        pool = HostPool.from_string("unix:///a.sock={}, tcp://b:2375".format(tmpdir))
+        assert [host.endpoint for host in pool.hosts] == ["unix:///a.sock", "tcp://b:2375"]
+        assert pool.hosts[0].get_free_disk() is not None
+        assert pool.hosts[1].get_free_disk() is None
+
+    def test_socket_path_from_string(self, tmpdir):
+        pool = HostPool.from_string("/run/docker1.sock={},/run/docker2.sock".format(tmpdir))
+        assert [host.endpoint for host in pool.hosts] == ["unix:///run/docker1.sock", "unix:///run/docker2.sock"]
+        assert pool.hosts[0].get_free_disk() is not None
+
+    def test_prefer_host_with_base_image(self, pool, daemons):
+        daemons["unix:///tmp/docker3.sock"].add("ubuntu")
+        assert pool.choose("ubuntu", COMMANDS).endpoint == "unix:///tmp/docker3.sock"
+
+    def test_prefer_host_with_less_load(self, pool):
+        for host in pool.hosts[:2]:
+            host.add_build(running_build())
+        assert pool.choose("ubuntu", COMMANDS) is pool.hosts[2]
+
+    def test_spread_builds(self, pool):
+        chosen = set()
+        for i in range(3):
+            host = pool.choose("ubuntu", COMMANDS)
+            host.add_build(running_build())
+            chosen.add(host)
+        assert chosen == set(pool.hosts)
+
+    def test_prefer_host_with_free_resources(self, pool):
+        with pool.hosts[0].reserve(Resources(cpus=4)):
+            assert pool.choose("ubuntu", COMMANDS, Resources(cpus=1)) is not pool.hosts[0]
+
+    def test_no_host_with_capacity(self, pool):
+        with raises(ValueError):
+            pool.choose("ubuntu", COMMANDS, Resources(cpus=5))
+
+    def test_prefer_cached_prefix(self, pool):
+        pool.hosts[1].get_build_cache("ubuntu", FILES, COMMANDS).add(0, "image1", {"exitcode": 0})
+        assert pool.choose("ubuntu", COMMANDS, files=FILES) is pool.hosts[1]
+        assert pool.choose("ubuntu", COMMANDS) is not pool.hosts[1]
+
+    def test_prefer_free_disk(self, daemons, monkeypatch):
+        disks = {"/disk1": 10, "/disk2": 500}
+        monkeypatch.setattr(placement.shutil, "disk_usage",
+                            lambda path: Usage(1000 * 2 ** 30, 0, disks[path] * 2 ** 30))
+        pool = HostPool([DockerHost("unix:///tmp/docker1.sock", "/disk1"),
+                         DockerHost("unix:///tmp/docker2.sock", "/disk2")])
+        assert pool.choose("ubuntu", COMMANDS).endpoint == "unix:///tmp/docker2.sock"
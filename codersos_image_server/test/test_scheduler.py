@@ -0,0 +1,103 @@
+from codersos_image_server.scheduler import parse_size, Resources, PackingScheduler
+from pytest import fixture, raises, mark
+from threading import Thread
+import time
+
+GIB = 2 ** 30
+
+@fixture
+def scheduler():
+    return PackingScheduler(Resources(4, 8 * GIB, None))
+
+
+class TestParseSize:
+
+    def test_number(self):
+        assert parse_size(123) == 123
+
+    def test_docker_run_units_are_binary(self):
+        assert parse_size("4g") == 4 * GIB
+        assert parse_size("512m") == 512 * 2 ** 20
+
+    def test_docker_stats_units(self):
+        assert parse_size("1.5GiB") == int(1.5 * GIB)
+        assert parse_size("12.3MB") == int(12.3 * 1000 ** 2)
+        assert parse_size("0B") == 0
+
+    def test_spaces(self):
+        assert parse_size(" 100 MiB ") == 100 * 2 ** 20
+
+    def test_invalid(self):
+        for size in ["", "g", "1x", None, "-1g", float("nan"), float("inf")]:
+            with raises(ValueError):
+                parse_size(size)
+
+
+class TestResources:
+
+    def test_from_dict(self):
+        resources = Resources.from_dict({"cpus": "2", "memory": "1g"})
+        assert resources == Resources(2.0, GIB, None)
+
+    @mark.parametrize("dictionary", [
+        {"cpus": -100}, {"cpus": 0}, {"cpus": float("nan")}, {"cpus": float("inf")},
+        {"cpus": "-1"}, {"cpus": "nan"}, {"cpus": "inf"},
+        {"memory": -5}, {"memory": 0}, {"memory": float("nan")}, {"memory": float("inf")},
+        {"disk": -5}, {"disk": "0g"}, {"disk": float("-inf")}])
+    def test_from_dict_rejects_values_which_are_not_finite_and_positive(self, dictionary):
+        with raises(ValueError):
+            Resources.from_dict(dictionary)
+
+    @mark.parametrize("dictionary", [{"cpus": 0.009}, {"memory": "5m"}, {"memory": 6 * 2 ** 20 - 1}])
+    def test_from_dict_rejects_values_below_docker_minimum(self, dictionary):
+        with raises(ValueError):
+            Resources.from_dict(dictionary)
+
+    def test_from_dict_accepts_docker_minimum(self):
+        assert Resources.from_dict({"cpus": 0.01, "memory": "6m"}) == Resources(0.01, 6 * 2 ** 20, None)
+
+    def test_replace_unlimited(self):
+        resources = Resources(1, None, None).replace_unlimited(Resources(2, 3, None))
+        assert resources == Resources(1, 3, None)
+
+    def test_no_docker_arguments_without_limits(self):
+        assert Resources().docker_arguments() == []
+
+    def test_docker_arguments(self):
+        assert Resources(1.5, 1024, 2048).docker_arguments() == \
+            ["--cpus", "1.5", "--memory", "1024", "--storage-opt", "size=2048"]
+
+    def test_fits_into(self):
+        assert Resources(4, None, 10).fits_into(Resources(4, 1, None))
+        assert not Resources(5, None, None).fits_into(Resources(4, None, None))
+
+
+class TestPackingScheduler:
+
+    def test_reservations_are_summed(self, scheduler):
+        with scheduler.reserve(Resources(1, GIB)):
+            with scheduler.reserve(Resources(2, GIB)):
+                assert scheduler.get_reserved() == Resources(3, 2 * GIB, 0)
+        assert scheduler.get_reserved() == Resources(0, 0, 0)
+
+    def test_too_large_reservation(self, scheduler):
+        assert not scheduler.fits(Resources(memory=9 * GIB))
+        with raises(ValueError):
+            scheduler.reserve(Resources(memory=9 * GIB))
+
+    def test_wait_until_reservation_fits(self, scheduler):
+        order = []
+        def build(name, resources):
+            with scheduler.reserve(resources):
+                order.append(name)
+                time.sleep(0.1)
+        with scheduler.reserve(Resources(3, GIB)):
+            waiting = Thread(target=build, args=("waiting", Resources(2, GIB)))
+            waiting.start()
+            admitted = Thread(target=build, args=("admitted", Resources(1, GIB)))
+            admitted.start()
+            admitted.join()
+            assert order == ["admitted"]
+            order.append("released")
+        waiting.join()
+        assert order == ["admitted", "released", "waiting"]
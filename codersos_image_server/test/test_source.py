@@ -0,0 +1,77 @@
+from codersos_image_server.source import SourceArchive, etag_matches
+from pytest import fixture
+import os
+import zipfile
+
+@fixture
+def directory(tmpdir):
+    source = tmpdir.mkdir("source")
+    source.join("app.py").write("print('hello')")
+    source.mkdir("test").join("test_app.py").write("")
+    source.mkdir("__pycache__").join("app.cpython-35.pyc").write("cache")
+    return source
+
+@fixture
+def archive(directory, tmpdir):
+    return SourceArchive(str(directory), str(tmpdir.mkdir("archives")))
+
+
+class TestEtagMatches:
+
+    def test_no_header(self):
+        assert not etag_matches(None, '"a"')
+
+    def test_list(self):
+        assert etag_matches('"b", "a"', '"a"')
+        assert not etag_matches('"b", "c"', '"a"')
+
+    def test_weak(self):
+        assert etag_matches('W/"a"', '"a"')
+
+    def test_star(self):
+        assert etag_matches("*", '"a"')
+
+
+class TestSourceArchive:
+
+    def test_content(self, archive):
+        path, etag, last_modified = archive.get()
+        with zipfile.ZipFile(path) as opened_archive:
+            assert sorted(opened_archive.namelist()) == ["app.py", "test/test_app.py"]
+            assert opened_archive.read("app.py") == b"print('hello')"
+
+    def test_archive_is_built_once(self, archive, monkeypatch):
+        first = archive.get()
+        def fail(*args):
+            assert False, "The archive must not be built again."
+        monkeypatch.setattr(archive, "_build", fail)
+        assert archive.get() == first
+
+    def test_etag_changes_with_content(self, archive, directory):
+        path, etag, last_modified = archive.get()
+        directory.join("app.py").write("print('changed')")
+        new_path, new_etag, new_last_modified = archive.get()
+        assert etag != new_etag
+        assert path != new_path
+        assert not os.path.exists(path)
+
+    def test_touching_keeps_the_archive(self, archive, directory):
+        first = archive.get()
+        os.utime(str(directory.join("app.py")), (1, 1))
+        assert archive.get() == first
+
+    def test_etag_is_the_same_for_the_same_content(self, archive, directory, tmpdir):
+        other = SourceArchive(str(directory), str(tmpdir.mkdir("other")))
+        assert archive.get()[1] == other.get()[1]
+
+    def test_archive_is_rebuilt_when_deleted(self, archive):
+        path, etag, last_modified = archive.get()
+        os.remove(path)
+        assert os.path.isfile(archive.get()[0])
+
+    def test_last_modified_is_the_newest_file(self, archive, directory):
+        os.utime(str(directory.join("app.py")), (1000000000, 1000000000))
+        os.utime(str(directory.join("test", "test_app.py")), (1000086400, 1000086400))
+        path, etag, last_modified = archive.get()
+        assert last_modified == "Mon, 10 Sep 2001 01:46:40 GMT"
+        assert os.path.getmtime(path) == 1000086400
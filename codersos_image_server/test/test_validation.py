@@ -0,0 +1,159 @@
+from codersos_image_server.validation import verify_specification, verify_request_size, \
+    SpecificationError, Limits, ARGUMENT_OVERHEAD
+from pytest import fixture, raises, mark
+import copy
+
+@fixture
+def specification():
+    return {"redirect": "http://localhost/",
+            "commands": [{"name": "1", "command": "#!/bin/bash\nls $1", "arguments": ["/"]},
+                         {"name": "2", "command": "#!/bin/bash\ntrue", "arguments": []}],
+            "image": "ubuntu",
+            "resources": {"cpus": 2, "memory": "4g"},
+            "files": [{"path": "/etc/x", "content": "x", "mode": "0600"},
+                      {"path": "/etc/y", "base64": "eQ=="}]}
+
+def assert_invalid(specification, path, limits=Limits()):
+    with raises(SpecificationError) as error:
+        verify_specification(specification, limits)
+    assert error.value.path == path
+    assert error.value.to_dict() == {"error": error.value.message, "path": path}
+
+
+class TestValidSpecification:
+
+    def test_valid(self, specification):
+        verify_specification(specification)
+
+    def test_minimal_specification(self):
+        verify_specification({"redirect": "https://localhost", "commands": []})
+
+    def test_specification_is_not_modified(self, specification):
+        before = copy.deepcopy(specification)
+        verify_specification(specification)
+        assert specification == before
+
+    def test_cache(self, specification):
+        for cache in [True, False]:
+            specification["cache"] = cache
+            verify_specification(specification)
+
+    def test_modes(self, specification):
+        for mode in ["755", "0755", "4755"]:
+            specification["files"][0]["mode"] = mode
+            verify_specification(specification)
+
+
+class TestInvalidSpecification:
+
+    def test_not_an_object(self):
+        assert_invalid([], None)
+
+    @mark.parametrize("change,path", [
+        (lambda s: s.pop("redirect"), "redirect"),
+        (lambda s: s.update(redirect="ftp://x"), "redirect"),
+        (lambda s: s.update(redirect=1), "redirect"),
+        (lambda s: s.pop("commands"), "commands"),
+        (lambda s: s.update(commands={}), "commands"),
+        (lambda s: s["commands"].append("ls"), "commands[2]"),
+        (lambda s: s["commands"][1].pop("name"), "commands[1].name"),
+        (lambda s: s["commands"][1].update(command=None), "commands[1].command"),
+        (lambda s: s["commands"][0].pop("arguments"), "commands[0].arguments"),
+        (lambda s: s["commands"][0]["arguments"].append(1), "commands[0].arguments[1]"),
+        (lambda s: s.update(image=["ubuntu"]), "image"),
+        (lambda s: s.update(resources=[]), "resources"),
+        (lambda s: s["resources"].update(gpus=1), "resources.gpus"),
+        (lambda s: s["resources"].update(cpus=True), "resources.cpus"),
+        (lambda s: s["resources"].update(memory="lots"), "resources.memory"),
+        (lambda s: s.update(resources={"cpus": -100, "memory": -5}), "resources.cpus"),
+        (lambda s: s.update(resources={"cpus": 1, "memory": -5}), "resources.memory"),
+        (lambda s: s["resources"].update(cpus=float("nan")), "resources.cpus"),
+        (lambda s: s["resources"].update(cpus="many"), "resources.cpus"),
+        (lambda s: s["resources"].update(disk=float("inf")), "resources.disk"),
+        (lambda s: s["resources"].update(cpus=0.001), "resources.cpus"),
+        (lambda s: s["resources"].update(memory="1m"), "resources.memory"),
+        (lambda s: s.update(files={}), "files"),
+        (lambda s: s["files"].append(None), "files[2]"),
+        (lambda s: s["files"][0].pop("path"), "files[0].path"),
+        (lambda s: s["files"][0].update(path="etc/x"), "files[0].path"),
+        (lambda s: s["files"][0].update(path="/"), "files[0].path"),
+        (lambda s: s["files"][0].update(path="/etc/"), "files[0].path"),
+        (lambda s: s["files"][0].update(path="/etc//x"), "files[0].path"),
+        (lambda s: s["files"][0].update(path="/etc/../x"), "files[0].path"),
+        (lambda s: s["files"][0].update(path="/etc/./x"), "files[0].path"),
+        (lambda s: s["files"][0].update(path="/.."), "files[0].path"),
+        (lambda s: s["files"][0].update(base64="eA=="), "files[0]"),
+        (lambda s: s["files"][0].pop("content"), "files[0]"),
+        (lambda s: s["files"][0].update(content=b"x"), "files[0].content"),
+        (lambda s: s["files"][1].update(base64="not base64!"), "files[1].base64"),
+        (lambda s: s["files"][0].update(mode="999"), "files[0].mode"),
+        (lambda s: s["files"][0].update(mode="10000"), "files[0].mode"),
+        (lambda s: s["files"][0].update(mode=755), "files[0].mode"),
+        (lambda s: s["files"][0].update(mode=0o644), "files[0].mode"),
+        (lambda s: s["files"][0].update(mode="0o644"), "files[0].mode"),
+        (lambda s: s["files"][0].update(mode=" 644"), "files[0].mode"),
+        (lambda s: s["files"][0].update(mode=None), "files[0].mode"),
+        (lambda s: s.update(cache="false"), "cache"),
+        (lambda s: s.update(cache=0), "cache"),
+        (lambda s: s.update(cache=None), "cache"),
+    ])
+    def test_error_path(self, specification, change, path):
+        change(specification)
+        assert_invalid(specification, path)
+
+
+class TestLimits:
+
+    def test_too_many_commands(self, specification):
+        assert_invalid(specification, "commands", Limits(commands=1))
+
+    def test_commands_at_limit(self, specification):
+        verify_specification(specification, Limits(commands=2))
+
+    def test_too_many_script_bytes(self, specification):
+        assert_invalid(specification, "commands[1]", Limits(script_bytes=30))
+
+    def test_arguments_count_as_script_bytes(self, specification):
+        limit = len(specification["commands"][0]["command"])
+        assert_invalid(specification, "commands[0]", Limits(script_bytes=limit))
+        total = limit + len("/") + ARGUMENT_OVERHEAD + len(specification["commands"][1]["command"])
+        verify_specification(specification, Limits(script_bytes=total))
+
+    def test_empty_arguments_count(self, specification):
+        specification["commands"][1]["arguments"] = [""] * 10 ** 6
+        assert_invalid(specification, "commands[1]")
+
+    def test_script_bytes_are_encoded(self, specification):
+        specification["commands"] = [{"name": "", "command": "ä", "arguments": []}]
+        assert_invalid(specification, "commands[0]", Limits(script_bytes=1))
+
+    def test_too_many_files(self, specification):
+        assert_invalid(specification, "files", Limits(files=1))
+
+    def test_from_environment(self):
+        limits = Limits.from_environment({"MAX_COMMANDS": "5", "MAX_BODY_SIZE": "100"})
+        assert limits == Limits(body_size=100, commands=5)
+
+    def test_default_from_environment(self):
+        assert Limits.from_environment({}) == Limits()
+
+
+class TestRequestSize:
+
+    def test_within_limit(self):
+        verify_request_size(100, None, Limits(body_size=100))
+
+    def test_empty_body(self):
+        verify_request_size(0, None)
+
+    def test_too_large(self):
+        with raises(SpecificationError) as error:
+            verify_request_size(101, None, Limits(body_size=100))
+        assert error.value.status == 400
+
+    @mark.parametrize("content_length,transfer_encoding", [
+        (-1, None), (-1, "chunked"), (10, "chunked"), (10, "gzip, Chunked")])
+    def test_length_is_required(self, content_length, transfer_encoding):
+        with raises(SpecificationError) as error:
+            verify_request_size(content_length, transfer_encoding)
+        assert error.value.status == 411
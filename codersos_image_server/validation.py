@@ -0,0 +1,181 @@
+import binascii
+import re
+from base64 import b64decode
+from collections import namedtuple
+from .scheduler import Resources
+
+REDIRECT = "redirect"
+COMMANDS = "commands"
+NAME = "name"
+COMMAND = "command"
+ARGUMENTS = "arguments"
+IMAGE = "image"
+RESOURCES = "resources"
+RESOURCE_NAMES = ("cpus", "memory", "disk")
+FILES = "files"
+PATH = "path"
+MODE = "mode"
+CONTENT = "content"
+BASE64 = "base64"
+CACHE = "cache"
+DEFAULT_FILE_MODE = 0o644
+FILE_MODE = re.compile(r"[0-7]{3,4}")
+# Each argument also needs a pointer and a terminating null byte in argv.
+ARGUMENT_OVERHEAD = 9
+
+
+class SpecificationError(ValueError):
+
+    def __init__(self, message, path=None, status=400):
+        """The specification is invalid.
+
+        path is where the error is in the specification,
+        for example `commands[2].arguments`.
+        status is the HTTP status code of the response.
+        """
+        super().__init__(message)
+        self.message = message
+        self.path = path
+        self.status = status
+
+    def to_dict(self):
+        """Return the error as the body of a 400 response."""
+        return {"error": self.message, "path": self.path}
+
+
+class Limits(namedtuple("Limits", ["body_size", "commands", "script_bytes", "files"])):
+    """Limits for the size of a specification.
+
+    - body_size is the maximum number of bytes of the request body.
+    - commands is the maximum number of commands.
+    - script_bytes is the maximum number of bytes of all commands
+      and arguments together. Each argument counts ARGUMENT_OVERHEAD
+      bytes more than its length.
+    - files is the maximum number of files.
+    """
+
+    __slots__ = ()
+
+    def __new__(cls, body_size=10 * 2 ** 20, commands=1000, script_bytes=2 ** 20, files=10000):
+        return super().__new__(cls, body_size, commands, script_bytes, files)
+
+    @classmethod
+    def from_environment(cls, environment):
+        """Create the limits from MAX_BODY_SIZE, MAX_COMMANDS, MAX_SCRIPT_BYTES and MAX_FILES."""
+        default = cls()
+        return cls(*(int(environment.get("MAX_" + name.upper(), value))
+                     for name, value in zip(cls._fields, default)))
+
+
+def is_url(url):
+    return url.startswith("http://") or url.startswith("https://")
+
+def get_file_mode(mode):
+    """Return the permissions of an octal file mode like "0644"."""
+    return int(mode, 8)
+
+def _expect(condition, message, path, status=400):
+    if not condition:
+        raise SpecificationError(message, path, status)
+
+def _get_attribute(dictionary, attribute, path):
+    _expect(attribute in dictionary, "The attribute is missing.", path)
+    return dictionary[attribute]
+
+def _verify_string(value, path):
+    _expect(isinstance(value, str), "The value must be a string.", path)
+
+def _verify_list(value, maximum, path):
+    _expect(isinstance(value, list), "The value must be a list.", path)
+    _expect(len(value) <= maximum,
+            "The list must not have more than {} entries.".format(maximum), path)
+
+def _verify_commands(commands, limits):
+    _verify_list(commands, limits.commands, COMMANDS)
+    script_bytes = 0
+    for index, command in enumerate(commands):
+        path = "{}[{}]".format(COMMANDS, index)
+        _expect(isinstance(command, dict), "The command must be an object.", path)
+        for attribute in (NAME, COMMAND):
+            _verify_string(_get_attribute(command, attribute, path + "." + attribute),
+                           path + "." + attribute)
+        arguments = _get_attribute(command, ARGUMENTS, path + "." + ARGUMENTS)
+        _expect(isinstance(arguments, list), "The value must be a list.", path + "." + ARGUMENTS)
+        script_bytes += len(command[COMMAND].encode())
+        for argument_index, argument in enumerate(arguments):
+            _verify_string(argument, "{}.{}[{}]".format(path, ARGUMENTS, argument_index))
+            script_bytes += len(argument.encode()) + ARGUMENT_OVERHEAD
+        _expect(script_bytes <= limits.script_bytes,
+                "The commands and arguments must not have more than {} bytes.".format(limits.script_bytes),
+                path)
+
+def _verify_resources(resources):
+    _expect(isinstance(resources, dict), "The value must be an object.", RESOURCES)
+    for name, value in resources.items():
+        path = RESOURCES + "." + name
+        _expect(name in RESOURCE_NAMES,
+                "This is not a resource. Use one of {}.".format(", ".join(RESOURCE_NAMES)), path)
+        _expect(isinstance(value, (str, int, float)) and not isinstance(value, bool),
+                "The value must be a number or a string.", path)
+        try:
+            Resources.from_dict({name: value})
+        except ValueError as error:
+            raise SpecificationError(str(error), path)
+
+def _verify_files(files, limits):
+    _verify_list(files, limits.files, FILES)
+    for index, file in enumerate(files):
+        path = "{}[{}]".format(FILES, index)
+        _expect(isinstance(file, dict), "The file must be an object.", path)
+        file_path = _get_attribute(file, PATH, path + "." + PATH)
+        _verify_string(file_path, path + "." + PATH)
+        _expect(file_path.startswith("/"), "The path must be absolute.", path + "." + PATH)
+        _expect(all(part not in ("", ".", "..") for part in file_path[1:].split("/")),
+                "The path must be a file without empty, \".\" or \"..\" parts.", path + "." + PATH)
+        _expect((CONTENT in file) != (BASE64 in file),
+                "The file must have either \"content\" or \"base64\".", path)
+        if CONTENT in file:
+            _verify_string(file[CONTENT], path + "." + CONTENT)
+        else:
+            _verify_string(file[BASE64], path + "." + BASE64)
+            try:
+                b64decode(file[BASE64], validate=True)
+            except binascii.Error:
+                raise SpecificationError("The value must be base64 encoded.", path + "." + BASE64)
+        if MODE in file:
+            mode = file[MODE]
+            _expect(isinstance(mode, str) and FILE_MODE.fullmatch(mode),
+                    "The mode must be a string with an octal permission like \"0644\".", path + "." + MODE)
+
+def verify_request_size(content_length, transfer_encoding, limits=Limits()):
+    """Raise a SpecificationError if the request body may be too large.
+
+    This must be called before the body is read.
+    content_length is -1 if there is no Content-Length header.
+    Requests without a length or with a chunked body are rejected
+    because their size is only known after reading them.
+    """
+    _expect(content_length >= 0 and "chunked" not in (transfer_encoding or "").lower(),
+            "The request must have a Content-Length header and must not be chunked.", None, 411)
+    _expect(content_length <= limits.body_size,
+            "The request must not have more than {} bytes.".format(limits.body_size), None)
+
+def verify_specification(specification, limits=Limits()):
+    """Raise a SpecificationError if the specification is invalid.
+
+    The specification is checked in one pass.
+    The limits bound the time this takes.
+    """
+    _expect(isinstance(specification, dict), "The image specification must be an object.", None)
+    redirect = _get_attribute(specification, REDIRECT, REDIRECT)
+    _verify_string(redirect, REDIRECT)
+    _expect(is_url(redirect), "The value must be a url.", REDIRECT)
+    _verify_commands(_get_attribute(specification, COMMANDS, COMMANDS), limits)
+    if IMAGE in specification:
+        _verify_string(specification[IMAGE], IMAGE)
+    if RESOURCES in specification:
+        _verify_resources(specification[RESOURCES])
+    if FILES in specification:
+        _verify_files(specification[FILES], limits)
+    if CACHE in specification:
+        _expect(isinstance(specification[CACHE], bool), "The value must be true or false.", CACHE)